@@ -1,15 +1,31 @@
 import os
+import ssl
+import logging
+from datetime import datetime, timezone
+from functools import lru_cache
 from cryptography import x509
+from cryptography.x509.verification import (
+    Criticality, ExtensionPolicy, PolicyBuilder, Store, VerificationError
+)
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.serialization import pkcs7
 from cryptography.hazmat.backends import default_backend
 import plistlib
 
-def load_vendor_certificate():
-    '''Load MDM vendor certificate and private key'''
-    cert_path = os.getenv('MDM_VENDOR_CERT_PATH', './certs/vendor_cert.pem')
-    key_path = os.getenv('MDM_VENDOR_KEY_PATH', './certs/vendor_key.pem')
-    
+logger = logging.getLogger(__name__)
+
+def log_openssl_backend():
+    '''Log the OpenSSL builds used for profile signing and for TLS'''
+    # cryptography >= 41 already refuses to load against OpenSSL < 1.1.1, so
+    # the version is logged for diagnostics rather than asserted on
+    logger.info(
+        "Signing with %s (ssl module: %s)",
+        default_backend().openssl_version_text(),
+        ssl.OPENSSL_VERSION
+    )
+
+def _load_certificate_and_key(cert_path, key_path):
+    '''Load a PEM certificate and its unencrypted PEM private key'''
     with open(cert_path, 'rb') as f:
         cert_data = f.read()
         cert = x509.load_pem_x509_certificate(cert_data, default_backend())
@@ -24,32 +40,105 @@ def load_vendor_certificate():
     
     return cert, key
 
-def sign_profile(profile_dict):
-    '''Sign a configuration profile with vendor certificate'''
-    cert, key = load_vendor_certificate()
+@lru_cache(maxsize=1)
+def load_vendor_certificate():
+    '''Load MDM vendor certificate and private key (parsed once and cached)'''
+    cert_path = os.getenv('MDM_VENDOR_CERT_PATH', './certs/vendor_cert.pem')
+    key_path = os.getenv('MDM_VENDOR_KEY_PATH', './certs/vendor_key.pem')
     
-    # Convert profile to plist
-    profile_data = plistlib.dumps(profile_dict)
+    return _load_certificate_and_key(cert_path, key_path)
+
+@lru_cache(maxsize=1)
+def load_profile_signing_certificate():
+    '''Load the profile-signing certificate and key (parsed once and cached)
+
+    The vendor key must stay RSA-2048 because Apple issues the vendor
+    certificate from it. When MDM_PROFILE_SIGNING_CERT_PATH/KEY_PATH point at
+    a separate (e.g. ECDSA P-256) pair, profiles are signed with that instead;
+    otherwise the vendor pair is used.
+    '''
+    cert_path = os.getenv('MDM_PROFILE_SIGNING_CERT_PATH')
+    key_path = os.getenv('MDM_PROFILE_SIGNING_KEY_PATH')
     
-    # Create PKCS#7 signature
-    options = [pkcs7.PKCS7Options.Binary]
+    if not cert_path or not key_path:
+        return load_vendor_certificate()
+    return _load_certificate_and_key(cert_path, key_path)
+
+_SIGN_ENCODING = serialization.Encoding.DER
+_SIGN_OPTIONS = (pkcs7.PKCS7Options.Binary,)
+
+@lru_cache(maxsize=1)
+def _get_signature_builder():
+    '''Build a PKCS#7 builder with the profile signer already attached'''
+    cert, key = load_profile_signing_certificate()
+    return pkcs7.PKCS7SignatureBuilder().add_signer(
+        cert, key, hashes.SHA256()
+    )
+
+def sign_profile(profile_dict):
+    '''Sign a configuration profile with the profile-signing certificate'''
+    # Convert profile to binary plist
+    profile_data = plistlib.dumps(profile_dict, fmt=plistlib.FMT_BINARY)
     
-    signed_data = pkcs7.PKCS7SignatureBuilder().set_data(
+    # Create PKCS#7 signature (builders are immutable, so the base is reusable)
+    signed_data = _get_signature_builder().set_data(
         profile_data
-    ).add_signer(
-        cert, key, hashes.SHA256()
     ).sign(
-        serialization.Encoding.DER,
-        options
+        _SIGN_ENCODING,
+        _SIGN_OPTIONS
     )
     
     return signed_data
 
-def verify_device_certificate(cert_data):
-    '''Verify device certificate against MDM CA'''
-    # Load the certificate
-    cert = x509.load_der_x509_certificate(cert_data, default_backend())
+# SCEP-issued device identity certificates usually carry only a subject CN,
+# so subjectAltName and authorityKeyIdentifier are optional on the leaf (the
+# web PKI defaults require both)
+_DEVICE_EE_POLICY = ExtensionPolicy.webpki_defaults_ee().may_be_present(
+    x509.SubjectAlternativeName, Criticality.AGNOSTIC, None
+).may_be_present(
+    x509.AuthorityKeyIdentifier, Criticality.NON_CRITICAL, None
+)
+
+@lru_cache(maxsize=1)
+def _get_device_policy_builder():
+    '''Build the policy for device certificates from the MDM CA (loaded once)'''
+    ca_path = os.getenv('MDM_CA_CERT_PATH', './certs/mdm_ca_cert.pem')
+    
+    with open(ca_path, 'rb') as f:
+        ca_certs = x509.load_pem_x509_certificates(f.read())
+    
+    return PolicyBuilder().store(Store(ca_certs)).extension_policies(
+        ca_policy=ExtensionPolicy.webpki_defaults_ca(),
+        ee_policy=_DEVICE_EE_POLICY
+    )
+
+def verify_device_certificate(cert_data, intermediates=()):
+    '''Verify device certificate against MDM CA
+
+    cert_data and each of intermediates are DER-encoded certificates.
+    Returns False for malformed or untrusted certificates. Raises OSError if
+    the MDM CA bundle cannot be read.
+    '''
+    try:
+        cert = x509.load_der_x509_certificate(cert_data, default_backend())
+        chain = [
+            x509.load_der_x509_certificate(data, default_backend())
+            for data in intermediates
+        ]
+    except ValueError as e:
+        logger.warning("Malformed device certificate: %s", e)
+        return False
+    
+    # Validation time is taken per call; the verifier itself is cheap to build
+    verifier = _get_device_policy_builder().time(
+        datetime.now(timezone.utc)
+    ).build_client_verifier()
+    
+    # Chain building and signature checks run inside OpenSSL-backed Rust code
+    try:
+        verifier.verify(cert, chain)
+    except VerificationError as e:
+        logger.warning("Device certificate verification failed: %s", e)
+        return False
     
-    # In production, verify against your MDM CA
-    # This is a placeholder for certificate validation
     return True
\ No newline at end of file
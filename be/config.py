@@ -1,3 +1,4 @@
+from typing import Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -14,6 +15,13 @@ class Settings(BaseSettings):
     mdm_vendor_cert_path: str = "./certs/vendor_cert.pem"
     mdm_vendor_key_path: str = "./certs/vendor_key.pem"
     
+    # Security - optional ECDSA profile-signing pair (defaults to the vendor pair)
+    mdm_profile_signing_cert_path: Optional[str] = None
+    mdm_profile_signing_key_path: Optional[str] = None
+    
+    # Security - MDM CA (issues device identity certificates)
+    mdm_ca_cert_path: str = "./certs/mdm_ca_cert.pem"
+    
     # APNs Certificate
     apns_cert_path: str = "./certs/mdm_push_cert.pem"
     apns_key_path: str = "./certs/mdm_push_key.pem"
@@ -1,22 +1,98 @@
-from src.apns_client import send_apns_notification
+from src.apns_client import send_bulk_notifications
+from certificate_utils import log_openssl_backend, sign_profile
 from fastapi import FastAPI, Request, Response, HTTPException, Depends
 from fastapi.responses import JSONResponse
+import asyncio
+import os
 import plistlib
 import uuid
+import time
+from collections import deque
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import msgspec
 import uvicorn
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Union
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Apple MDM Server", version="1.0.0")
+
+_json_encoder = msgspec.json.Encoder()
+
+
+class MsgspecJSONResponse(JSONResponse):
+    """JSON response encoded with msgspec (handles Structs natively)"""
+    
+    def render(self, content) -> bytes:
+        return _json_encoder.encode(content)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Own the signing thread pool and the pending APNs wake flush"""
+    global _wake_flush_task
+    log_openssl_backend()
+    app.state.signing_executor = ThreadPoolExecutor(
+        max_workers=os.cpu_count(), thread_name_prefix="profile-signing"
+    )
+    yield
+    if _wake_flush_task is not None:
+        # Queued wakes stay in pending_wakes for the next flush
+        _wake_flush_task.cancel()
+        _wake_flush_task = None
+    app.state.signing_executor.shutdown(wait=False)
+
+
+app = FastAPI(
+    title="Apple MDM Server",
+    version="1.0.0",
+    default_response_class=MsgspecJSONResponse,
+    lifespan=lifespan
+)
+
+
+class Device(msgspec.Struct):
+    """Enrolled device record"""
+    udid: str
+    token: Optional[bytes]
+    # APNs addresses devices by hex token; encoded once per TokenUpdate
+    token_hex: Optional[str]
+    push_magic: Optional[str]
+    unlock_token: Optional[bytes]
+    enrolled_at: str
+    last_seen: str
+    lost_mode_enabled: bool = False
+    lost_mode_message: Optional[str] = None
+    lost_mode_phone: Optional[str] = None
+
+
+class DeviceView(msgspec.Struct):
+    """Device record as returned by the management API (tokens hex-encoded)"""
+    udid: str
+    token: Optional[str]
+    push_magic: Optional[str]
+    unlock_token: Optional[str]
+    enrolled_at: str
+    last_seen: str
+    lost_mode_enabled: bool
+    lost_mode_message: Optional[str]
+    lost_mode_phone: Optional[str]
+
 
 # In-memory storage (replace with database in production)
 enrolled_devices = {}
-pending_commands = {}
+pending_commands = {}  # udid -> deque of (RequestType, encoded command plist)
+# Strong references to in-flight APNs sends so they are not garbage collected
+push_tasks = set()
+# Devices waiting for a coalesced APNs wake-up, flushed once per window
+pending_wakes = set()
+_wake_flush_task = None
+WAKE_COALESCE_WINDOW = 0.2  # seconds
 
 # MDM Configuration
 MDM_CONFIG = {
@@ -24,25 +100,190 @@ MDM_CONFIG = {
     "checkin_url": "/mdm/checkin",
     "command_url": "/mdm/command",
     "organization": "Your Organization",
-    "topic": "com.apple.mgmt.External.your-uuid"  # APNs topic
+    "topic": "com.apple.mgmt.External.your-uuid",  # APNs topic
+    # Sign a fresh profile (with new UUIDs) on every /enroll request
+    "unique_enrollment_profiles": False
 }
 
+# Static request/payload values shared across requests
+_DEVICE_INFO_QUERIES = (
+    "DeviceName", "OSVersion", "BuildVersion", "ModelName",
+    "Model", "ProductName", "SerialNumber", "DeviceCapacity",
+    "AvailableDeviceCapacity", "BatteryLevel", "UDID",
+    "IsSupervised", "IsDeviceLocatorServiceEnabled"
+)
+_SERVER_CAPABILITIES = ("com.apple.mdm.per-user-connections",)
+_FULL_ACCESS_RIGHTS = 8191
+
+# Largest check-in/command body accepted from a device
+MAX_PLIST_BODY_SIZE = 10 * 1024 * 1024
+
 
 # ==================== Utility Functions ====================
 
+# Cached (epoch second, ISO string) pair used by utc_now_iso()
+_now_iso_cache = [0, ""]
+
+
+def utc_now_iso() -> str:
+    """Current UTC time as an ISO string, reformatted at most once per second"""
+    now = int(time.time())
+    if now != _now_iso_cache[0]:
+        _now_iso_cache[0] = now
+        _now_iso_cache[1] = datetime.utcfromtimestamp(now).isoformat()
+    return _now_iso_cache[1]
+
+
 def parse_plist(data: bytes) -> dict:
     """Parse plist data from request body"""
     try:
         return plistlib.loads(data)
     except Exception as e:
-        logger.error(f"Failed to parse plist: {e}")
+        logger.error("Failed to parse plist: %s", e)
         raise HTTPException(status_code=400, detail="Invalid plist data")
 
 
-def create_plist_response(data: dict) -> Response:
-    """Create plist response"""
-    plist_data = plistlib.dumps(data)
-    return Response(content=plist_data, media_type="application/xml")
+async def read_plist_body(request: Request) -> dict:
+    """Read the request body, rejecting oversized bodies early, and parse it as a plist"""
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > MAX_PLIST_BODY_SIZE:
+            raise HTTPException(status_code=413, detail="Plist body too large")
+        chunks.append(chunk)
+    return parse_plist(b"".join(chunks))
+
+
+def _on_push_done(task: asyncio.Task):
+    """Release a finished background APNs send and log unexpected errors"""
+    push_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Background APNs send failed: %s", task.exception())
+
+
+async def _flush_wakes():
+    """Wake every device queued during the last window with a single push each"""
+    global _wake_flush_task
+    await asyncio.sleep(WAKE_COALESCE_WINDOW)
+    
+    devices = [enrolled_devices[udid] for udid in pending_wakes if udid in enrolled_devices]
+    pending_wakes.clear()
+    # Let wakes requested while this batch is sending start a new window
+    _wake_flush_task = None
+    
+    if devices:
+        await send_bulk_notifications(
+            [device.token_hex for device in devices],
+            [device.push_magic for device in devices],
+            MDM_CONFIG["topic"]
+        )
+
+
+def _on_wake_flush_done(task: asyncio.Task):
+    """Forget a flush that was cancelled or failed before it started sending"""
+    global _wake_flush_task
+    if _wake_flush_task is task:
+        _wake_flush_task = None
+    _on_push_done(task)
+
+
+def request_wake(udid: str):
+    """Schedule an APNs wake-up for a device, coalescing repeated requests"""
+    global _wake_flush_task
+    pending_wakes.add(udid)
+    if _wake_flush_task is None or _wake_flush_task.done():
+        _wake_flush_task = asyncio.create_task(_flush_wakes())
+        push_tasks.add(_wake_flush_task)
+        _wake_flush_task.add_done_callback(_on_wake_flush_done)
+
+
+def encode_plist(data: dict) -> bytes:
+    """Encode data as a binary plist (key order is irrelevant to MDM clients)"""
+    return plistlib.dumps(data, fmt=plistlib.FMT_BINARY, sort_keys=False)
+
+
+def create_plist_response(data: Union[dict, bytes]) -> Response:
+    """Create binary plist response from a dict or already-encoded plist"""
+    plist_data = data if isinstance(data, bytes) else encode_plist(data)
+    return Response(content=plist_data, media_type="application/x-plist")
+
+
+def device_view(device: Device) -> DeviceView:
+    """Hex-encode a device's tokens for the management API"""
+    return DeviceView(
+        device.udid,
+        device.token_hex,
+        device.push_magic,
+        device.unlock_token.hex() if device.unlock_token is not None else None,
+        device.enrolled_at,
+        device.last_seen,
+        device.lost_mode_enabled,
+        device.lost_mode_message,
+        device.lost_mode_phone
+    )
+
+
+def uuid4_batch(count: int) -> list:
+    """Generate several random UUID strings from a single os.urandom call"""
+    data = os.urandom(16 * count)
+    return [
+        str(uuid.UUID(bytes=data[i:i + 16], version=4))
+        for i in range(0, len(data), 16)
+    ]
+
+
+@lru_cache(maxsize=16)
+def _enrollment_profile_base(organization: str, topic: str, server_url: str) -> tuple:
+    """Static parts of the enrollment profile and its MDM payload (no UUIDs)"""
+    mdm_payload = {
+        "PayloadType": "com.apple.mdm",
+        "PayloadVersion": 1,
+        "PayloadDisplayName": "MDM Enrollment",
+        "PayloadDescription": "Enrolls device into MDM",
+        "PayloadOrganization": organization,
+        "CheckInURL": f"{server_url}{MDM_CONFIG['checkin_url']}",
+        "ServerURL": f"{server_url}{MDM_CONFIG['command_url']}",
+        "Topic": topic,
+        "ServerCapabilities": _SERVER_CAPABILITIES,
+        "AccessRights": _FULL_ACCESS_RIGHTS,
+    }
+    profile = {
+        "PayloadType": "Configuration",
+        "PayloadVersion": 1,
+        "PayloadDisplayName": "MDM Enrollment Profile",
+        "PayloadDescription": "Install this profile to enroll in MDM",
+        "PayloadOrganization": organization,
+    }
+    return mdm_payload, profile
+
+
+def build_enrollment_profile(organization: str, topic: str, server_url: str) -> dict:
+    """Build an unsigned MDM enrollment profile"""
+    mdm_base, profile_base = _enrollment_profile_base(organization, topic, server_url)
+    mdm_id, mdm_uuid, identity_uuid, profile_id, profile_uuid = uuid4_batch(5)
+    
+    mdm_payload = mdm_base.copy()
+    mdm_payload["PayloadIdentifier"] = f"com.yourorg.mdm.{mdm_id}"
+    mdm_payload["PayloadUUID"] = mdm_uuid
+    mdm_payload["IdentityCertificateUUID"] = identity_uuid
+    
+    profile = profile_base.copy()
+    profile["PayloadContent"] = [mdm_payload]
+    profile["PayloadIdentifier"] = f"com.yourorg.profile.{profile_id}"
+    profile["PayloadUUID"] = profile_uuid
+    return profile
+
+
+def build_signed_enrollment(organization: str, topic: str, server_url: str) -> bytes:
+    """Build and sign an MDM enrollment profile with the vendor certificate"""
+    return sign_profile(build_enrollment_profile(organization, topic, server_url))
+
+
+@lru_cache(maxsize=16)
+def _build_signed_enrollment(organization: str, topic: str, server_url: str) -> bytes:
+    """Signed enrollment profile shared by every device enrolling with these settings"""
+    return build_signed_enrollment(organization, topic, server_url)
 
 
 # ==================== MDM Endpoints ====================
@@ -54,37 +295,21 @@ async def root():
 
 
 @app.get("/enroll")
-async def enrollment_profile():
+async def enrollment_profile(request: Request):
     """Generate MDM enrollment profile"""
-    from be.src.certificate_utils import sign_profile
-    
-    profile = {
-        "PayloadContent": [{
-            "PayloadType": "com.apple.mdm",
-            "PayloadVersion": 1,
-            "PayloadIdentifier": f"com.yourorg.mdm.{uuid.uuid4()}",
-            "PayloadUUID": str(uuid.uuid4()),
-            "PayloadDisplayName": "MDM Enrollment",
-            "PayloadDescription": "Enrolls device into MDM",
-            "PayloadOrganization": MDM_CONFIG["organization"],
-            "CheckInURL": f"{MDM_CONFIG['server_url']}{MDM_CONFIG['checkin_url']}",
-            "ServerURL": f"{MDM_CONFIG['server_url']}{MDM_CONFIG['command_url']}",
-            "Topic": MDM_CONFIG["topic"],
-            "IdentityCertificateUUID": str(uuid.uuid4()),
-            "ServerCapabilities": ["com.apple.mdm.per-user-connections"],
-            "AccessRights": 8191,  # Full access
-        }],
-        "PayloadType": "Configuration",
-        "PayloadVersion": 1,
-        "PayloadIdentifier": f"com.yourorg.profile.{uuid.uuid4()}",
-        "PayloadUUID": str(uuid.uuid4()),
-        "PayloadDisplayName": "MDM Enrollment Profile",
-        "PayloadDescription": "Install this profile to enroll in MDM",
-        "PayloadOrganization": MDM_CONFIG["organization"],
-    }
-    
-    # Sign the profile with vendor certificate
-    signed_profile = sign_profile(profile)
+    if MDM_CONFIG["unique_enrollment_profiles"]:
+        build = build_signed_enrollment
+    else:
+        build = _build_signed_enrollment
+    
+    # Signing is CPU-bound, keep it off the event loop
+    signed_profile = await asyncio.get_running_loop().run_in_executor(
+        request.app.state.signing_executor,
+        build,
+        MDM_CONFIG["organization"],
+        MDM_CONFIG["topic"],
+        MDM_CONFIG["server_url"]
+    )
     
     return Response(
         content=signed_profile,
@@ -98,17 +323,16 @@ async def enrollment_profile():
 @app.put("/mdm/checkin")
 async def mdm_checkin(request: Request):
     """Handle MDM check-in messages (Authenticate, TokenUpdate, CheckOut)"""
-    body = await request.body()
-    data = parse_plist(body)
+    data = await read_plist_body(request)
     
     message_type = data.get("MessageType")
     udid = data.get("UDID")
     
-    logger.info(f"CheckIn - MessageType: {message_type}, UDID: {udid}")
+    logger.info("CheckIn - MessageType: %s, UDID: %s", message_type, udid)
     
     if message_type == "Authenticate":
         # Device is authenticating
-        logger.info(f"Device {udid} authenticating")
+        logger.info("Device %s authenticating", udid)
         return Response(status_code=200)
     
     elif message_type == "TokenUpdate":
@@ -116,25 +340,26 @@ async def mdm_checkin(request: Request):
         token = data.get("Token")
         push_magic = data.get("PushMagic")
         unlock_token = data.get("UnlockToken")
+        now = utc_now_iso()
         
-        enrolled_devices[udid] = {
-            "udid": udid,
-            "token": token.hex() if token else None,
-            "push_magic": push_magic,
-            "unlock_token": unlock_token.hex() if unlock_token else None,
-            "enrolled_at": datetime.utcnow().isoformat(),
-            "last_seen": datetime.utcnow().isoformat(),
-            "lost_mode_enabled": False
-        }
+        enrolled_devices[udid] = Device(
+            udid=udid,
+            token=token,
+            token_hex=token.hex() if token is not None else None,
+            push_magic=push_magic,
+            unlock_token=unlock_token,
+            enrolled_at=now,
+            last_seen=now
+        )
         
-        logger.info(f"Device {udid} token updated")
+        logger.info("Device %s token updated", udid)
         return Response(status_code=200)
     
     elif message_type == "CheckOut":
         # Device is un-enrolling
         if udid in enrolled_devices:
             del enrolled_devices[udid]
-        logger.info(f"Device {udid} checked out")
+        logger.info("Device %s checked out", udid)
         return Response(status_code=200)
     
     return Response(status_code=400)
@@ -143,34 +368,33 @@ async def mdm_checkin(request: Request):
 @app.put("/mdm/command")
 async def mdm_command(request: Request):
     """Handle MDM command responses and send pending commands"""
-    body = await request.body()
-    data = parse_plist(body)
+    data = await read_plist_body(request)
     
     udid = data.get("UDID")
     status = data.get("Status")
     command_uuid = data.get("CommandUUID")
     
-    logger.info(f"Command response - UDID: {udid}, Status: {status}, UUID: {command_uuid}")
+    logger.info("Command response - UDID: %s, Status: %s, UUID: %s", udid, status, command_uuid)
     
     # Update device last seen
     if udid in enrolled_devices:
-        enrolled_devices[udid]["last_seen"] = datetime.utcnow().isoformat()
+        enrolled_devices[udid].last_seen = utc_now_iso()
     
     # Process command response
     if status == "Acknowledged":
-        logger.info(f"Command {command_uuid} acknowledged by {udid}")
+        logger.info("Command %s acknowledged by %s", command_uuid, udid)
         # Process response data
         if "QueryResponses" in data:
-            logger.info(f"Query responses: {data['QueryResponses']}")
+            logger.info("Query responses: %s", data["QueryResponses"])
     elif status == "Error":
         error_chain = data.get("ErrorChain", [])
-        logger.error(f"Command {command_uuid} failed: {error_chain}")
+        logger.error("Command %s failed: %s", command_uuid, error_chain)
     
     # Check for pending commands
     if udid in pending_commands and pending_commands[udid]:
-        command = pending_commands[udid].pop(0)
-        logger.info(f"Sending pending command to {udid}: {command['Command']['RequestType']}")
-        return create_plist_response(command)
+        request_type, command_plist = pending_commands[udid].popleft()
+        logger.info("Sending pending command to %s: %s", udid, request_type)
+        return create_plist_response(command_plist)
     
     # No pending commands
     return Response(status_code=200)
@@ -181,7 +405,10 @@ async def mdm_command(request: Request):
 @app.get("/api/devices")
 async def list_devices():
     """List all enrolled devices"""
-    return {"devices": list(enrolled_devices.values())}
+    # Returned as a response object so the Structs skip jsonable_encoder
+    return MsgspecJSONResponse(
+        {"devices": [device_view(device) for device in enrolled_devices.values()]}
+    )
 
 
 @app.get("/api/devices/{udid}")
@@ -189,7 +416,7 @@ async def get_device(udid: str):
     """Get device details"""
     if udid not in enrolled_devices:
         raise HTTPException(status_code=404, detail="Device not found")
-    return enrolled_devices[udid]
+    return MsgspecJSONResponse(device_view(enrolled_devices[udid]))
 
 
 @app.post("/api/devices/{udid}/command")
@@ -199,7 +426,6 @@ async def send_command(udid: str, command: dict):
     if udid not in enrolled_devices:
         raise HTTPException(status_code=404, detail="Device not found")
     
-    device = enrolled_devices[udid]
     command_uuid = str(uuid.uuid4())
     mdm_command = {
         "CommandUUID": command_uuid,
@@ -207,38 +433,29 @@ async def send_command(udid: str, command: dict):
     }
     
     if udid not in pending_commands:
-        pending_commands[udid] = []
+        pending_commands[udid] = deque()
     
-    pending_commands[udid].append(mdm_command)
-    logger.info(f"Command queued for {udid}: {command.get('RequestType')}")
+    # Encode at queue time so device polls only pop ready-made bytes
+    pending_commands[udid].append((command.get("RequestType"), encode_plist(mdm_command)))
+    logger.info("Command queued for %s: %s", udid, command.get("RequestType"))
     
-    # Send APNs notification to wake device
-    push_result = await send_apns_notification(
-        token=device["token"],
-        push_magic=device["push_magic"],
-        topic=MDM_CONFIG["topic"]
-    )
+    # Wake the device via APNs in the background; one push per window
+    # covers every command queued for it in the meantime
+    request_wake(udid)
     
     return {
         "status": "queued",
         "command_uuid": command_uuid,
-        "apns_sent": push_result
+        "apns_sent": "pending"
     }
 
 
 @app.post("/api/devices/{udid}/device-info")
 async def request_device_info(udid: str):
     """Request device information"""
-    queries = [
-        "DeviceName", "OSVersion", "BuildVersion", "ModelName",
-        "Model", "ProductName", "SerialNumber", "DeviceCapacity",
-        "AvailableDeviceCapacity", "BatteryLevel", "UDID",
-        "IsSupervised", "IsDeviceLocatorServiceEnabled"
-    ]
-    
     command = {
         "RequestType": "DeviceInformation",
-        "Queries": queries
+        "Queries": _DEVICE_INFO_QUERIES
     }
     
     return await send_command(udid, command)
@@ -249,7 +466,7 @@ async def install_profile(udid: str, profile: dict):
     """Install a configuration profile"""
     command = {
         "RequestType": "InstallProfile",
-        "Payload": plistlib.dumps(profile)
+        "Payload": encode_plist(profile)
     }
     
     return await send_command(udid, command)
@@ -293,12 +510,13 @@ async def enable_lost_mode(
         command["Footnote"] = footnote
     
     # Update device status
-    enrolled_devices[udid]["lost_mode_enabled"] = True
-    enrolled_devices[udid]["lost_mode_message"] = message
-    enrolled_devices[udid]["lost_mode_phone"] = phone_number
+    device = enrolled_devices[udid]
+    device.lost_mode_enabled = True
+    device.lost_mode_message = message
+    device.lost_mode_phone = phone_number
     
     result = await send_command(udid, command)
-    logger.info(f"Lost Mode enabled for device {udid}")
+    logger.info("Lost Mode enabled for device %s", udid)
     
     return result
 
@@ -309,7 +527,8 @@ async def disable_lost_mode(udid: str):
     if udid not in enrolled_devices:
         raise HTTPException(status_code=404, detail="Device not found")
     
-    if not enrolled_devices[udid].get("lost_mode_enabled"):
+    device = enrolled_devices[udid]
+    if not device.lost_mode_enabled:
         raise HTTPException(status_code=400, detail="Lost Mode is not enabled")
     
     command = {
@@ -317,12 +536,12 @@ async def disable_lost_mode(udid: str):
     }
     
     # Update device status
-    enrolled_devices[udid]["lost_mode_enabled"] = False
-    enrolled_devices[udid].pop("lost_mode_message", None)
-    enrolled_devices[udid].pop("lost_mode_phone", None)
+    device.lost_mode_enabled = False
+    device.lost_mode_message = None
+    device.lost_mode_phone = None
     
     result = await send_command(udid, command)
-    logger.info(f"Lost Mode disabled for device {udid}")
+    logger.info("Lost Mode disabled for device %s", udid)
     
     return result
 
@@ -338,7 +557,7 @@ async def get_lost_mode_location(udid: str):
     }
     
     result = await send_command(udid, command)
-    logger.info(f"Location requested for device {udid}")
+    logger.info("Location requested for device %s", udid)
     
     return result
 
@@ -354,7 +573,7 @@ async def play_lost_mode_sound(udid: str):
     }
     
     result = await send_command(udid, command)
-    logger.info(f"Lost Mode sound requested for device {udid}")
+    logger.info("Lost Mode sound requested for device %s", udid)
     
     return result
 
@@ -36,8 +36,9 @@ echo "2. Convert APNs Push Certificate (.p12 to PEM)"
 echo "3. Verify Certificate Setup"
 echo "4. View Certificate Information"
 echo "5. Complete Setup (All Steps)"
+echo "6. Generate ECDSA Profile-Signing CSR and Private Key (optional)"
 echo ""
-read -p "Enter option (1-5): " option
+read -p "Enter option (1-6): " option
 
 case $option in
     1)
@@ -152,6 +153,11 @@ EOF
         
         all_good=true
         
+        # The server signs with the OpenSSL bundled in the cryptography wheel,
+        # not this CLI, so the version here is informational only
+        print_info "openssl CLI: $(openssl version)"
+        print_info "Compare 'openssl speed -evp sha256' with 'openssl speed sha256' to confirm hardware acceleration"
+        
         # Check Vendor Certificate
         if [ -f "certs/vendor_cert.pem" ]; then
             print_success "Vendor certificate found"
@@ -176,6 +182,21 @@ EOF
             all_good=false
         fi
         
+        # Check optional profile-signing key (used instead of the vendor key for profiles)
+        if [ -f "certs/profile_signing_key.pem" ]; then
+            if openssl ec -in certs/profile_signing_key.pem -check -noout 2>/dev/null; then
+                print_success "Profile-signing key is valid"
+            else
+                print_error "Profile-signing key is invalid or corrupted"
+                all_good=false
+            fi
+            if [ -f "certs/profile_signing_cert.pem" ]; then
+                print_success "Profile-signing certificate found"
+            else
+                print_info "Profile-signing certificate not installed yet (certs/profile_signing_cert.pem)"
+            fi
+        fi
+        
         # Check Vendor CSR
         if [ -f "certs/vendor_csr.pem" ]; then
             print_success "Vendor CSR found"
@@ -336,6 +357,51 @@ EOF
         rm -f certs/csr_config.txt.bak
         ;;
         
+    6)
+        echo ""
+        echo "=== Generating ECDSA Profile-Signing CSR and Private Key ==="
+        echo ""
+        print_info "The vendor key stays RSA-2048 as Apple requires; this separate"
+        print_info "P-256 key only signs enrollment profiles, which is much faster."
+        echo ""
+        
+        read -p "Organization Name: " org_name
+        read -p "Common Name (e.g., Your MDM Profile Signing): " common_name
+        read -p "Country Code (2 letters): " country
+        
+        openssl ecparam -name prime256v1 -genkey -noout -out certs/profile_signing_key.pem
+        
+        print_success "Private key generated: certs/profile_signing_key.pem"
+        
+        cat > certs/profile_signing_csr_config.txt <<EOF
+[req]
+prompt = no
+default_md = sha256
+distinguished_name = dn
+req_extensions = v3_req
+
+[dn]
+C=$country
+O=$org_name
+CN=$common_name
+
+[v3_req]
+keyUsage = critical, digitalSignature
+EOF
+
+        openssl req -new -key certs/profile_signing_key.pem \
+            -out certs/profile_signing_csr.pem \
+            -config certs/profile_signing_csr_config.txt
+        
+        print_success "CSR generated: certs/profile_signing_csr.pem"
+        
+        echo ""
+        echo "=== Next Steps ==="
+        print_info "1. Have certs/profile_signing_csr.pem signed by a CA your devices trust"
+        print_info "2. Save the certificate as certs/profile_signing_cert.pem"
+        print_info "3. Set MDM_PROFILE_SIGNING_CERT_PATH and MDM_PROFILE_SIGNING_KEY_PATH"
+        ;;
+        
     *)
         print_error "Invalid option"
         exit 1
@@ -5,12 +5,19 @@ import os
 
 logger = logging.getLogger(__name__)
 
+# Concurrent HTTP/2 streams allowed on the shared APNs connection
+MAX_CONCURRENT_SENDS = 256
+# Devices scheduled at once by send_bulk_notifications
+BULK_BATCH_SIZE = 1000
+MDM_PUSH_TYPE = PushType.MDM
+
 class APNsClient:
     def __init__(self):
         self.client = None
         self.cert_path = os.getenv('APNS_CERT_PATH', './certs/mdm_push_cert.pem')
         self.key_path = os.getenv('APNS_KEY_PATH', './certs/mdm_push_key.pem')
         self.use_sandbox = os.getenv('APNS_USE_SANDBOX', 'true').lower() == 'true'
+        self.send_limit = asyncio.Semaphore(MAX_CONCURRENT_SENDS)
     
     async def get_client(self):
         if self.client is None:
@@ -37,33 +44,33 @@ async def send_apns_notification(token: str, push_magic: str, topic: str):
             message={
                 "mdm": push_magic
             },
-            push_type=PushType.MDM,
+            push_type=MDM_PUSH_TYPE,
             topic=topic
         )
         
-        response = await client.send_notification(request)
+        async with apns_client.send_limit:
+            response = await client.send_notification(request)
         
         if response.is_successful:
-            logger.info(f"APNs notification sent successfully to {token[:10]}...")
+            logger.info("APNs notification sent successfully to %s...", token[:10])
             return True
         else:
-            logger.error(f"APNs notification failed: {response.description}")
+            logger.error("APNs notification failed: %s", response.description)
             return False
             
     except Exception as e:
-        logger.error(f"Error sending APNs notification: {e}")
+        logger.error("Error sending APNs notification: %s", e)
         return False
 
-async def send_bulk_notifications(devices: list):
-    '''Send APNs notifications to multiple devices'''
-    tasks = []
-    for device in devices:
-        task = send_apns_notification(
-            device['token'],
-            device['push_magic'],
-            device.get('topic', os.getenv('MDM_TOPIC'))
-        )
-        tasks.append(task)
+async def send_bulk_notifications(tokens: list, push_magics: list, topic: str):
+    '''Send APNs notifications to multiple devices given parallel lists of push data'''
+    results = []
+    for start in range(0, len(tokens), BULK_BATCH_SIZE):
+        end = start + BULK_BATCH_SIZE
+        tasks = [
+            send_apns_notification(token, push_magic, topic)
+            for token, push_magic in zip(tokens[start:end], push_magics[start:end])
+        ]
+        results.extend(await asyncio.gather(*tasks, return_exceptions=True))
     
-    results = await asyncio.gather(*tasks, return_exceptions=True)
     return results
\ No newline at end of file
@@ -0,0 +1,201 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from cryptography.hazmat.primitives.serialization import pkcs7
+from cryptography.x509.oid import ExtendedKeyUsageOID, NameOID
+
+import certificate_utils
+
+
+def _name(common_name):
+    return x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+
+
+def make_ca():
+    key = ec.generate_private_key(ec.SECP256R1())
+    now = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(_name("MDM CA"))
+        .issuer_name(_name("MDM CA"))
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=365))
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .add_extension(
+            x509.KeyUsage(False, False, False, False, False, True, True, False, False),
+            critical=True,
+        )
+        .add_extension(x509.SubjectKeyIdentifier.from_public_key(key.public_key()), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    return cert, key
+
+
+def make_device_cert(ca_key, not_valid_before=None, not_valid_after=None, san=False, aki=True):
+    """Device identity certificate shaped like a SCEP-issued one (CN only)"""
+    key = ec.generate_private_key(ec.SECP256R1())
+    now = datetime.now(timezone.utc)
+    builder = (
+        x509.CertificateBuilder()
+        .subject_name(_name("device-udid"))
+        .issuer_name(_name("MDM CA"))
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(not_valid_before or now - timedelta(days=1))
+        .not_valid_after(not_valid_after or now + timedelta(days=30))
+        .add_extension(x509.BasicConstraints(ca=False, path_length=None), critical=True)
+        .add_extension(
+            x509.KeyUsage(True, False, False, False, False, False, False, False, False),
+            critical=True,
+        )
+        .add_extension(x509.ExtendedKeyUsage([ExtendedKeyUsageOID.CLIENT_AUTH]), critical=False)
+    )
+    if aki:
+        builder = builder.add_extension(
+            x509.AuthorityKeyIdentifier.from_issuer_public_key(ca_key.public_key()),
+            critical=False,
+        )
+    if san:
+        builder = builder.add_extension(
+            x509.SubjectAlternativeName([x509.DNSName("device.example.com")]), critical=False
+        )
+    return builder.sign(ca_key, hashes.SHA256()).public_bytes(serialization.Encoding.DER)
+
+
+@pytest.fixture
+def ca_key(tmp_path, monkeypatch):
+    cert, key = make_ca()
+    ca_path = tmp_path / "mdm_ca_cert.pem"
+    ca_path.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    monkeypatch.setenv("MDM_CA_CERT_PATH", str(ca_path))
+    certificate_utils._get_device_policy_builder.cache_clear()
+    yield key
+    certificate_utils._get_device_policy_builder.cache_clear()
+
+
+def test_accepts_device_cert_without_san(ca_key):
+    assert certificate_utils.verify_device_certificate(make_device_cert(ca_key))
+
+
+def test_accepts_device_cert_without_aki(ca_key):
+    assert certificate_utils.verify_device_certificate(make_device_cert(ca_key, aki=False))
+
+
+def test_accepts_device_cert_with_san(ca_key):
+    assert certificate_utils.verify_device_certificate(make_device_cert(ca_key, san=True))
+
+
+def test_rejects_cert_from_another_ca(ca_key):
+    _, other_key = make_ca()
+    assert not certificate_utils.verify_device_certificate(make_device_cert(other_key))
+
+
+def test_rejects_expired_cert(ca_key):
+    now = datetime.now(timezone.utc)
+    cert = make_device_cert(
+        ca_key,
+        not_valid_before=now - timedelta(days=30),
+        not_valid_after=now - timedelta(days=1),
+    )
+    assert not certificate_utils.verify_device_certificate(cert)
+
+
+def test_validation_time_is_taken_per_call(ca_key):
+    assert certificate_utils.verify_device_certificate(make_device_cert(ca_key))
+
+    # Issued after the CA policy was cached; must still validate
+    time.sleep(1.1)
+    cert = make_device_cert(ca_key, not_valid_before=datetime.now(timezone.utc))
+    assert certificate_utils.verify_device_certificate(cert)
+
+
+def test_malformed_der_returns_false(ca_key):
+    assert not certificate_utils.verify_device_certificate(b"not a certificate")
+
+
+def test_intermediates_are_der(ca_key):
+    intermediate = make_ca()[0].public_bytes(serialization.Encoding.DER)
+    assert certificate_utils.verify_device_certificate(make_device_cert(ca_key), [intermediate])
+    assert not certificate_utils.verify_device_certificate(
+        make_device_cert(ca_key), [b"not a certificate"]
+    )
+
+
+def write_signing_pair(tmp_path, name, key):
+    now = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(_name(name))
+        .issuer_name(_name(name))
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=30))
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = tmp_path / f"{name}_cert.pem"
+    key_path = tmp_path / f"{name}_key.pem"
+    cert_path.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    key_path.write_bytes(key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ))
+    return cert, str(cert_path), str(key_path)
+
+
+@pytest.fixture
+def signing_pairs(tmp_path, monkeypatch):
+    vendor_cert, vendor_cert_path, vendor_key_path = write_signing_pair(
+        tmp_path, "vendor", rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    )
+    profile_cert, profile_cert_path, profile_key_path = write_signing_pair(
+        tmp_path, "profile", ec.generate_private_key(ec.SECP256R1())
+    )
+    monkeypatch.setenv("MDM_VENDOR_CERT_PATH", vendor_cert_path)
+    monkeypatch.setenv("MDM_VENDOR_KEY_PATH", vendor_key_path)
+    monkeypatch.delenv("MDM_PROFILE_SIGNING_CERT_PATH", raising=False)
+    monkeypatch.delenv("MDM_PROFILE_SIGNING_KEY_PATH", raising=False)
+
+    def clear_caches():
+        certificate_utils.load_vendor_certificate.cache_clear()
+        certificate_utils.load_profile_signing_certificate.cache_clear()
+        certificate_utils._get_signature_builder.cache_clear()
+
+    clear_caches()
+    yield vendor_cert, (profile_cert, profile_cert_path, profile_key_path), clear_caches
+    clear_caches()
+
+
+def signer_of(signed):
+    return pkcs7.load_der_pkcs7_certificates(signed)
+
+
+def test_profiles_signed_with_vendor_pair_by_default(signing_pairs):
+    vendor_cert, _, _ = signing_pairs
+    signed = certificate_utils.sign_profile({"PayloadType": "Configuration"})
+    assert signer_of(signed) == [vendor_cert]
+
+
+def test_profiles_signed_with_separate_profile_signing_pair(signing_pairs, monkeypatch):
+    _, (profile_cert, cert_path, key_path), clear_caches = signing_pairs
+    monkeypatch.setenv("MDM_PROFILE_SIGNING_CERT_PATH", cert_path)
+    monkeypatch.setenv("MDM_PROFILE_SIGNING_KEY_PATH", key_path)
+    clear_caches()
+
+    signed = certificate_utils.sign_profile({"PayloadType": "Configuration"})
+    assert signer_of(signed) == [profile_cert]
+
+
+def test_missing_ca_bundle_raises(tmp_path, monkeypatch):
+    monkeypatch.setenv("MDM_CA_CERT_PATH", str(tmp_path / "missing.pem"))
+    certificate_utils._get_device_policy_builder.cache_clear()
+    _, key = make_ca()
+    with pytest.raises(OSError):
+        certificate_utils.verify_device_certificate(make_device_cert(key))
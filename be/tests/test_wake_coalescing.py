@@ -0,0 +1,95 @@
+import asyncio
+import plistlib
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+WINDOW = 0.05
+
+
+@pytest.fixture
+def pushes(monkeypatch):
+    """Record send_bulk_notifications calls instead of talking to APNs"""
+    calls = []
+
+    async def fake_send_bulk_notifications(tokens, push_magics, topic):
+        calls.append((tokens, push_magics, topic))
+        return [True] * len(tokens)
+
+    monkeypatch.setattr(main, "send_bulk_notifications", fake_send_bulk_notifications)
+    monkeypatch.setattr(main, "WAKE_COALESCE_WINDOW", WINDOW)
+    monkeypatch.setattr(main, "_wake_flush_task", None)
+    main.enrolled_devices.clear()
+    main.pending_commands.clear()
+    main.pending_wakes.clear()
+    yield calls
+    main.enrolled_devices.clear()
+    main.pending_commands.clear()
+    main.pending_wakes.clear()
+
+
+def enroll(client, udid, token):
+    body = plistlib.dumps({
+        "MessageType": "TokenUpdate",
+        "UDID": udid,
+        "Token": token,
+        "PushMagic": f"magic-{udid}",
+    })
+    assert client.put("/mdm/checkin", content=body).status_code == 200
+
+
+def queue_command(client, udid, request_type="DeviceLocation"):
+    response = client.post(f"/api/devices/{udid}/command", json={"RequestType": request_type})
+    assert response.status_code == 200
+    assert response.json()["apns_sent"] == "pending"
+
+
+def test_burst_of_commands_sends_one_push(pushes):
+    with TestClient(main.app) as client:
+        enroll(client, "device-1", b"\x01\x02")
+        for request_type in ("EnableLostMode", "DeviceLock", "DeviceInformation"):
+            queue_command(client, "device-1", request_type)
+        time.sleep(WINDOW * 4)
+
+    assert pushes == [(["0102"], ["magic-device-1"], main.MDM_CONFIG["topic"])]
+    assert len(main.pending_commands["device-1"]) == 3
+
+
+def test_wakes_recover_after_cancelled_flush(pushes):
+    with TestClient(main.app) as client:
+        enroll(client, "device-1", b"\x01\x02")
+        queue_command(client, "device-1")
+    # Lifespan shutdown cancelled the flush before its window elapsed
+    assert pushes == []
+    assert main._wake_flush_task is None
+
+    with TestClient(main.app) as client:
+        queue_command(client, "device-1")
+        time.sleep(WINDOW * 4)
+
+    assert pushes == [(["0102"], ["magic-device-1"], main.MDM_CONFIG["topic"])]
+
+
+def test_wakes_recover_after_flush_cancelled_directly(pushes):
+    async def scenario():
+        main.enrolled_devices["device-1"] = main.Device(
+            udid="device-1",
+            token=b"\x01\x02",
+            token_hex="0102",
+            push_magic="magic-device-1",
+            unlock_token=None,
+            enrolled_at="",
+            last_seen="",
+        )
+        main.request_wake("device-1")
+        main._wake_flush_task.cancel()
+        await asyncio.sleep(0)
+
+        main.request_wake("device-1")
+        await asyncio.sleep(WINDOW * 4)
+
+    asyncio.run(scenario())
+    assert pushes == [(["0102"], ["magic-device-1"], main.MDM_CONFIG["topic"])]